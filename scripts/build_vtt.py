@@ -29,17 +29,24 @@ from __future__ import annotations
 import argparse
 import dataclasses
 import json
-import math
+import os
 import re
 import unicodedata
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import zip_longest
 from pathlib import Path
-from typing import Iterable, Iterator, List, Optional, Sequence
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-from faster_whisper import WhisperModel
-from slugify import slugify
+import ctranslate2
+import numpy as np
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+from rapidfuzz.distance import Hamming
 
 
 _WORD_RE = re.compile(r"\w+", re.UNICODE)
+_NON_WORD_RE = re.compile(r"[^\w]", re.UNICODE)
+_VTT_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
 
 
 @dataclasses.dataclass
@@ -52,19 +59,27 @@ class TranscriptLine:
 
 
 @dataclasses.dataclass
-class Word:
-    """Represents a recognized word with normalized text and timestamps."""
+class WordBuffer:
+    """Recognized words stored as parallel arrays, one entry per word."""
 
-    text: str
-    normalized: str
-    start: float
-    end: float
+    # Declared by hand rather than with ``slots=True`` to keep Python 3.9 support.
+    __slots__ = ("starts", "ends", "normalized", "texts")
+
+    starts: np.ndarray
+    ends: np.ndarray
+    normalized: List[str]
+    texts: List[str]
+
+    def __len__(self) -> int:
+        return len(self.normalized)
 
 
 @dataclasses.dataclass
 class Cue:
     """Represents a WebVTT cue."""
 
+    __slots__ = ("identifier", "start", "end", "transcript")
+
     identifier: str
     start: float
     end: float
@@ -73,105 +88,164 @@ class Cue:
     def to_vtt(self) -> str:
         start = seconds_to_timestamp(self.start)
         end = seconds_to_timestamp(self.end)
-        cue_body = f"<span class=\"pt\">{escape_vtt(self.transcript.text)}</span>"
-        if self.transcript.translation:
-            cue_body += "<br/><span class=\"en\">"
-            cue_body += escape_vtt(self.transcript.translation)
-            cue_body += "</span>"
-        return f"{self.identifier}\n{start} --> {end}\n{cue_body}\n"
+        translation = (
+            f"<br/><span class=\"en\">{escape_vtt(self.transcript.translation)}</span>"
+            if self.transcript.translation
+            else ""
+        )
+        return (
+            f"{self.identifier}\n{start} --> {end}\n"
+            f"<span class=\"pt\">{escape_vtt(self.transcript.text)}</span>{translation}\n"
+        )
 
 
 class AlignmentError(RuntimeError):
     """Raised when the alignment process fails fatally."""
 
 
+@lru_cache(maxsize=8192)
 def normalize_token(token: str) -> str:
     token = token.casefold()
+    if token.isascii():
+        return _NON_WORD_RE.sub("", token)
+    # Combining marks (category Mn) are not word characters, so the regex below
+    # also strips the accents split off by NFD.
     token = unicodedata.normalize("NFD", token)
-    token = "".join(ch for ch in token if unicodedata.category(ch) != "Mn")
-    token = re.sub(r"[^\w]", "", token)
-    return token
+    return _NON_WORD_RE.sub("", token)
 
 
 def load_transcript(path: Path, translation_path: Optional[Path]) -> List[TranscriptLine]:
     def iter_lines(p: Path) -> Iterator[str]:
-        for raw in p.read_text(encoding="utf-8").splitlines():
-            stripped = raw.strip()
-            if stripped and not stripped.startswith("#"):
-                yield stripped
-
-    portuguese_lines = list(iter_lines(path))
-    translations: List[Optional[str]]
-
-    if translation_path:
-        english_lines = list(iter_lines(translation_path))
-        if len(english_lines) != len(portuguese_lines):
+        with p.open("r", encoding="utf-8") as handle:
+            for raw in handle:
+                stripped = raw.strip()
+                if stripped and not stripped.startswith("#"):
+                    yield stripped
+
+    if not translation_path:
+        return [TranscriptLine(index=i, text=pt) for i, pt in enumerate(iter_lines(path))]
+
+    lines: List[TranscriptLine] = []
+    # Both files are read in lockstep; a missing partner line means the counts differ.
+    for i, (pt, en) in enumerate(zip_longest(iter_lines(path), iter_lines(translation_path))):
+        if pt is None or en is None:
             raise AlignmentError(
                 "The Portuguese and English transcripts must have the same number of non-empty lines."
             )
-        translations = english_lines
-    else:
-        translations = [None] * len(portuguese_lines)
+        lines.append(TranscriptLine(index=i, text=pt, translation=en))
+    return lines
 
-    return [
-        TranscriptLine(index=i, text=pt, translation=translations[i])
-        for i, pt in enumerate(portuguese_lines)
-    ]
 
+def default_compute_type(device: str) -> str:
+    """Pick an int8 compute type for the device faster-whisper will run on."""
+
+    if device == "cuda" or (device == "auto" and ctranslate2.get_cuda_device_count() > 0):
+        return "int8_float16"
+    return "int8"
 
-def transcribe_audio(model: WhisperModel, audio_path: Path, *, language: str) -> List[Word]:
-    """Transcribe the audio and return a flattened list of timestamped words."""
+
+def transcribe_audio(
+    model: BatchedInferencePipeline,
+    audio_path: Path,
+    *,
+    language: str,
+    beam_size: int = 1,
+    batch_size: int = 16,
+) -> WordBuffer:
+    """Transcribe the audio and return a flattened list of timestamped words.
+
+    The batched pipeline splits the audio into speech chunks with VAD and
+    decodes ``batch_size`` chunks at a time, skipping silence and music beds.
+    Word timestamps stay on the original audio timeline.
+
+    Only the word timestamps are used for alignment, so greedy decoding
+    (``beam_size=1``) is enough.  The reference transcript supplies the text, so
+    decoding is not conditioned on previous segments to avoid drift, and the
+    compression-ratio, log-probability and no-speech thresholds are pinned so
+    repetitive or silent windows are rejected instead of decoded at length.
+    """
 
     segments, _ = model.transcribe(
         str(audio_path),
         language=language,
-        beam_size=5,
+        beam_size=beam_size,
         word_timestamps=True,
+        condition_on_previous_text=False,
+        compression_ratio_threshold=2.4,
+        log_prob_threshold=-1.0,
+        no_speech_threshold=0.6,
+        batch_size=batch_size,
+        vad_filter=True,
+        vad_parameters={"min_silence_duration_ms": 500},
     )
 
-    words: List[Word] = []
+    starts: List[float] = []
+    ends: List[float] = []
+    normalized_words: List[str] = []
+    texts: List[str] = []
     for segment in segments:
         for word in segment.words:
             normalized = normalize_token(word.word)
             if not normalized:
                 continue
-            words.append(
-                Word(
-                    text=word.word,
-                    normalized=normalized,
-                    start=float(word.start),
-                    end=float(word.end),
-                )
-            )
-    if not words:
+            starts.append(word.start)
+            ends.append(word.end)
+            normalized_words.append(normalized)
+            texts.append(word.word)
+    if not texts:
         raise AlignmentError("No words were recognized in the audio. Check the language parameter and audio quality.")
-    return words
+    return WordBuffer(
+        starts=np.asarray(starts, dtype=np.float64),
+        ends=np.asarray(ends, dtype=np.float64),
+        normalized=normalized_words,
+        texts=texts,
+    )
 
 
-def align_transcript(lines: Sequence[TranscriptLine], words: Sequence[Word]) -> List[Cue]:
-    cues: List[Cue] = []
+def align_transcript(lines: Sequence[TranscriptLine], words: WordBuffer) -> Iterator[Cue]:
+    """Yield one cue per transcript line, in order."""
+
+    previous_end: Optional[float] = None
     pointer = 0
     word_count = len(words)
-    average_word_duration = sum(w.end - w.start for w in words) / max(word_count, 1)
+    starts = words.starts
+    ends = words.ends
+    normalized = words.normalized
+    average_word_duration = float((ends - starts).mean()) if word_count else 0.0
+
+    # Inverted index of normalized word -> ascending word indices, so exact
+    # matches are found without scanning the search window.
+    posting: Dict[str, List[int]] = {}
+    for idx, candidate in enumerate(normalized):
+        posting.setdefault(candidate, []).append(idx)
+
+    # Tokenize every line up front; empty tokens can never match a word.
+    line_tokens: List[Tuple[str, ...]] = [
+        tuple(filter(None, map(normalize_token, _WORD_RE.findall(line.text)))) for line in lines
+    ]
 
-    for line in lines:
-        tokens = [normalize_token(token) for token in _WORD_RE.findall(line.text)]
+    # Lines are aligned sequentially on purpose: each line's search window starts
+    # where the previous line's matches ended, and the remaining work is
+    # GIL-bound dict/bisect lookups, so thread-level splitting would gain little
+    # and would misalign lines near chunk boundaries.
+    for line, tokens in zip(lines, line_tokens):
         token_matches: List[int] = []
 
         for token in tokens:
+            window_end = min(pointer + 30, word_count)
+            plist = posting.get(token)
+            if plist:
+                position = bisect_left(plist, pointer)
+                if position < len(plist) and plist[position] < window_end:
+                    token_matches.append(plist[position])
+                    pointer = plist[position] + 1
+                    continue
+
             best_index = None
             best_score = 0.0
-            search_window = range(pointer, min(pointer + 30, word_count))
-            for idx in search_window:
-                candidate = words[idx].normalized
-                if not candidate:
-                    continue
-                if candidate == token:
-                    best_index = idx
-                    best_score = 1.0
-                    break
+            for idx in range(pointer, window_end):
                 # Fallback to partial ratio to cope with punctuation differences.
-                score = similarity(token, candidate)
+                score = similarity(token, normalized[idx])
                 if score > best_score:
                     best_score = score
                     best_index = idx
@@ -180,62 +254,68 @@ def align_transcript(lines: Sequence[TranscriptLine], words: Sequence[Word]) ->
                 pointer = best_index + 1
 
         if token_matches:
-            start_word = words[token_matches[0]]
-            end_word = words[token_matches[-1]]
-            start_time = start_word.start
-            end_time = end_word.end
+            start_time = starts[token_matches[0]]
+            end_time = ends[token_matches[-1]]
         else:
             # Fallback: estimate a reasonable window around the current pointer.
             start_idx = min(pointer, word_count - 1)
             end_idx = min(start_idx + max(len(tokens), 1), word_count - 1)
-            start_time = words[start_idx].start
-            end_time = words[end_idx].end
+            start_time = starts[start_idx]
+            end_time = ends[end_idx]
             pointer = end_idx + 1
 
         # Guarantee strictly increasing timestamps.
-        if cues:
-            previous_end = cues[-1].end
+        if previous_end is not None:
             start_time = max(start_time, previous_end + 1e-3)
         if end_time <= start_time:
             end_time = start_time + max(average_word_duration, 0.3)
 
-        identifier = f"line-{slugify(line.index, lowercase=False)}"
-        cues.append(Cue(identifier=identifier, start=start_time, end=end_time, transcript=line))
-
-    return cues
+        identifier = f"line-{line.index}"
+        previous_end = end_time
+        yield Cue(identifier=identifier, start=start_time, end=end_time, transcript=line)
 
 
 def seconds_to_timestamp(value: float) -> str:
-    hours = int(value // 3600)
-    minutes = int((value % 3600) // 60)
-    seconds = int(value % 60)
-    milliseconds = int(round((value - math.floor(value)) * 1000))
+    milliseconds = int(round(value * 1000))
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}"
 
 
 def escape_vtt(text: str) -> str:
-    return (
-        text.replace("&", "&amp;")
-        .replace("<", "&lt;")
-        .replace(">", "&gt;")
-    )
+    return text.translate(_VTT_ESCAPE)
 
 
 def similarity(a: str, b: str) -> float:
-    """Compute a simple similarity ratio between two strings."""
+    """Compute a simple similarity ratio between two strings.
+
+    Pairs whose lengths alone cap the ratio below the 0.6 acceptance threshold
+    used by ``align_transcript`` short-circuit to 0.0.
+    """
 
     if not a or not b:
         return 0.0
-    matches = sum(1 for x, y in zip(a, b) if x == y)
-    return matches / max(len(a), len(b))
+    len_a, len_b = len(a), len(b)
+    # The ratio can never exceed min(len_a, len_b) / max(len_a, len_b).
+    if len_a * 10 < len_b * 6 or len_b * 10 < len_a * 6:
+        return 0.0
+    # Padded Hamming similarity is the number of equal characters at the same
+    # position, computed with rapidfuzz's C implementation.
+    return Hamming.similarity(a, b) / max(len_a, len_b)
+
 
+def write_vtt(output_path: Path, cues: Iterable[Cue]) -> int:
+    """Write cues to ``output_path`` as they are produced and return the count."""
 
-def write_vtt(output_path: Path, cues: Sequence[Cue]) -> None:
+    count = 0
     with output_path.open("w", encoding="utf-8") as handle:
         handle.write("WEBVTT\n\n")
         for cue in cues:
-            handle.write(cue.to_vtt())
-            handle.write("\n")
+            # One write per cue: the cue text plus the blank separator line.
+            handle.write(f"{cue.to_vtt()}\n")
+            count += 1
+    return count
 
 
 def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
@@ -262,6 +342,24 @@ def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
         default="auto",
         help="Inference device for faster-whisper (auto, cpu, cuda).",
     )
+    parser.add_argument(
+        "--compute-type",
+        help="CTranslate2 compute type for the Whisper model (default: int8 on CPU, "
+        "int8_float16 on CUDA).",
+    )
+    parser.add_argument(
+        "--beam-size",
+        type=int,
+        default=1,
+        help="Beam size for Whisper decoding (default: 1, greedy). Larger beams are slower and "
+        "only help when the recognized text itself matters.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=16,
+        help="Number of audio chunks decoded together by Whisper (default: 16).",
+    )
     parser.add_argument(
         "--language",
         default="pt",
@@ -278,6 +376,11 @@ def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
         type=Path,
         help="Optional path to export alignment diagnostics as JSON.",
     )
+    parser.add_argument(
+        "--pretty",
+        action="store_true",
+        help="Indent the --dump-debug JSON for readability (slower on long episodes).",
+    )
     return parser.parse_args(argv)
 
 
@@ -285,10 +388,27 @@ def main(argv: Optional[Sequence[str]] = None) -> None:
     args = parse_args(argv)
 
     transcript_lines = load_transcript(args.portuguese, args.english)
-    model = WhisperModel(args.model, device=args.device)
-    words = transcribe_audio(model, args.audio, language=args.language)
-    cues = align_transcript(transcript_lines, words)
-    write_vtt(args.output, cues)
+    compute_type = args.compute_type or default_compute_type(args.device)
+    model = BatchedInferencePipeline(
+        model=WhisperModel(
+            args.model,
+            device=args.device,
+            compute_type=compute_type,
+            cpu_threads=os.cpu_count() or 0,
+        )
+    )
+    words = transcribe_audio(
+        model,
+        args.audio,
+        language=args.language,
+        beam_size=args.beam_size,
+        batch_size=args.batch_size,
+    )
+    cues: Iterable[Cue] = align_transcript(transcript_lines, words)
+    if args.dump_debug:
+        # Only keep the cues in memory when the debug dump needs them.
+        cues = list(cues)
+    cue_count = write_vtt(args.output, cues)
 
     if args.dump_debug:
         debug_payload = {
@@ -307,9 +427,10 @@ def main(argv: Optional[Sequence[str]] = None) -> None:
                 for cue in cues
             ],
         }
-        args.dump_debug.write_text(json.dumps(debug_payload, indent=2), encoding="utf-8")
+        with args.dump_debug.open("w", encoding="utf-8") as handle:
+            json.dump(debug_payload, handle, ensure_ascii=False, indent=2 if args.pretty else None)
 
-    print(f"Generated {len(cues)} cues in {args.output}")
+    print(f"Generated {cue_count} cues in {args.output}")
 
 
 if __name__ == "__main__":